@@ -1,13 +1,45 @@
 import streamlit as st
 import os
-import subprocess
 import tempfile
-import base64
 from pathlib import Path
-import platform
-import re
-import music21
 import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from utils.file_converter import convert_batch_to_zip, convert_lilypond_to_files, sweep_cache
+from utils.lilypond_finder import find_lilypond
+from utils.lilypond_text import enhance_lilypond_output, extract_title_from_lilypond
+
+# Static page text
+TAB_LABELS = ("Input Text", "Upload File", "MIDI to LilyPond")
+
+INTRO_MD = """
+This app converts LilyPond notation to PDF sheet music and MIDI files, and can also convert MIDI files to LilyPond notation.
+"""
+
+HOWTO_MD = """
+### How to Use This App
+1. **Input Text Tab**: Enter LilyPond notation directly
+   - Paste your LilyPond code or use the sample
+   - Set your output filename
+   - Click "Convert to PDF"
+
+2. **Upload File Tab**: Upload existing LilyPond files
+   - Upload one or more .ly files; several files are bundled into a ZIP
+   - Set your output filename
+   - Click "Convert to PDF"
+
+3. **MIDI to LilyPond Tab**: Convert MIDI files to LilyPond notation
+   - Upload a MIDI file
+   - Configure conversion options
+   - Click "Convert MIDI to LilyPond"
+   - Optionally send the generated code to the Text Input tab
+
+4. Download the generated PDF and MIDI files
+
+### About LilyPond
+[LilyPond](https://lilypond.org/) is an open-source music engraving program that produces beautiful sheet music.
+This app requires LilyPond to be installed on the server where Streamlit is running.
+"""
 
 st.set_page_config(
     page_title="LilyPond to PDF Converter",
@@ -17,68 +49,8 @@ st.set_page_config(
 
 # Title and description
 st.title("LilyPond to PDF Converter")
-st.markdown("""
-This app converts LilyPond notation to PDF sheet music and MIDI files, and can also convert MIDI files to LilyPond notation.
-""")
-
-# Function to extract title from LilyPond code
-def extract_title_from_lilypond(ly_content):
-    """Extract the title from LilyPond header."""
-    # Look for the header block
-    header_match = re.search(r'\\header\s*{([^}]*)}', ly_content, re.DOTALL)
-    if not header_match:
-        return None
-        
-    header_content = header_match.group(1)
-    
-    # Look for the title within the header
-    title_match = re.search(r'title\s*=\s*"([^"]*)"', header_content)
-    if title_match:
-        title = title_match.group(1)
-        # Convert title to a valid filename by replacing problematic characters
-        safe_title = re.sub(r'[\\/:*?"<>|]', '_', title)
-        return safe_title
-    
-    return None
+st.markdown(INTRO_MD)
 
-# Functions for MIDI to LilyPond enhancement
-def enhance_lilypond_output(lily_text):
-    """Post-process the music21-generated LilyPond code to improve structure and readability."""
-    
-    # Fix the staff naming to be more meaningful
-    lily_text = re.sub(r'Staff\s+=\s+\w+', 'Staff = "upper"', lily_text, count=1)
-    lily_text = re.sub(r'Staff\s+=\s+\w+', 'Staff = "lower"', lily_text, count=1)
-    
-    # Fix empty clef or incorrect clefs
-    lily_text = re.sub(r'\\clef\s+""', '\\clef "bass"', lily_text)
-    
-    # Add proper header with title
-    if '\\header {' in lily_text:
-        lily_text = lily_text.replace('\\header {', '\\header {\n  title = "MIDI Conversion"\n  composer = "Auto-generated"\n')
-    else:
-        # If header doesn't exist, add one
-        lily_text = lily_text.replace('\\version', '\\header {\n  title = "MIDI Conversion"\n  composer = "Auto-generated"\n}\n\n\\version')
-    
-    # Try to identify musical sections based on rest patterns or key changes
-    # Add comments for better readability
-    if '\\key' in lily_text:
-        lily_text = re.sub(r'(\\key\s+\w+\s+\\[a-zA-Z]+)', r'% New section\n\1', lily_text)
-    
-    # Add tempo markings if they don't exist
-    if '\\tempo' not in lily_text:
-        lily_text = re.sub(r'(\\time\s+\d+\/\d+)', r'\1\n    \\tempo 4 = 120', lily_text, count=1)
-    
-    # Structure the score better
-    lily_text = lily_text.replace('\\score {', '\\score {\n  % Main score')
-    
-    # Add MIDI output if not present
-    if '\\midi' not in lily_text and '\\layout' in lily_text:
-        lily_text = lily_text.replace('\\layout {', '\\layout { }\n  \\midi {')
-        # Find the last closing brace of layout and add one for midi
-        last_brace_pos = lily_text.rfind('}')
-        lily_text = lily_text[:last_brace_pos] + '\n  }' + lily_text[last_brace_pos:]
-    
-    return lily_text
 
 def analyze_musical_structure(score):
     """Analyze the musical structure to identify sections and themes."""
@@ -90,68 +62,46 @@ def analyze_musical_structure(score):
     # Find sections by looking for key changes, tempo changes, 
     # or significant pauses
     for part in score.parts:
-        measures = part.getElementsByClass('Measure')
-        
         current_section_start = 0
-        for i, measure in enumerate(measures):
+        i = -1
+        
+        # Walk the part's measures and key signatures once, in order, instead
+        # of filtering every measure's contents separately
+        for element in part.recurse().getElementsByClass(('Measure', 'KeySignature')):
+            if 'Measure' in element.classes:
+                i += 1
             # Look for key changes
-            key_signatures = measure.getElementsByClass('KeySignature')
-            if key_signatures:
-                if i > current_section_start:
-                    sections.append((current_section_start, i-1))
-                    current_section_start = i
+            elif i > current_section_start:
+                sections.append((current_section_start, i-1))
+                current_section_start = i
     
     return sections
 
 # Check if LilyPond is installed on the server
-@st.cache_resource
-def find_lilypond():
-    """Attempt to find the LilyPond executable on the system."""
-    try:
-        # Try to get LilyPond version which will fail if not installed
-        result = subprocess.run(['lilypond', '--version'], 
-                                capture_output=True, text=True, check=False)
-        if result.returncode == 0:
-            return 'lilypond'  # It's in the PATH
-    except FileNotFoundError:
-        pass
-        
-    # Common installation paths to check
-    common_paths = []
-    
-    # Windows common paths
-    if os.name == 'nt':
-        program_files = os.environ.get('PROGRAMFILES', 'C:\\Program Files')
-        program_files_x86 = os.environ.get('PROGRAMFILES(X86)', 'C:\\Program Files (x86)')
-        
-        for base_dir in [program_files, program_files_x86]:
-            common_paths.extend([
-                os.path.join(base_dir, 'LilyPond', 'usr', 'bin', 'lilypond.exe'),
-                os.path.join(base_dir, 'LilyPond', 'bin', 'lilypond.exe')
-            ])
-    
-    # macOS common paths
-    elif platform.system() == 'darwin':
-        common_paths.extend([
-            '/Applications/LilyPond.app/Contents/Resources/bin/lilypond',
-            os.path.expanduser('~/Applications/LilyPond.app/Contents/Resources/bin/lilypond')
-        ])
-    
-    # Linux common paths
-    else:
-        common_paths.extend([
-            '/usr/bin/lilypond',
-            '/usr/local/bin/lilypond'
-        ])
-    
-    # Check each path
-    for path in common_paths:
-        if os.path.isfile(path) and os.access(path, os.X_OK):
-            return path
-            
-    return None
+@st.cache_resource(show_spinner=False)
+def _get_lilypond_path():
+    """Locate LilyPond once per server process instead of on every rerun."""
+    return find_lilypond()
+
+lilypond_path = _get_lilypond_path()
+
+@st.cache_resource(show_spinner=False)
+def _sweep_cache():
+    """Tidy the output cache once per server process."""
+    sweep_cache()
 
-lilypond_path = find_lilypond()
+# An unusable cache directory should not stop the app from starting; each
+# conversion reports its own error if it cannot write there either. Errors
+# are not cached, so the sweep is tried again on the next rerun
+try:
+    _sweep_cache()
+except OSError as e:
+    st.warning(f"The output cache could not be prepared: {e}")
+
+@st.cache_resource(show_spinner=False)
+def _get_executor():
+    """Worker pool shared by all sessions for running LilyPond."""
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 2)
 
 # Display LilyPond status
 if lilypond_path:
@@ -159,132 +109,157 @@ if lilypond_path:
 else:
     st.error("❌ LilyPond not found. You need to install LilyPond on the server running this app.")
     st.info("Download LilyPond from [lilypond.org](https://lilypond.org/download.html)")
+    # A missing install is cached as well, so offer a way to look again
+    if st.button("Check again"):
+        find_lilypond.cache_clear()
+        _get_lilypond_path.clear()
+        st.rerun()
+
+# Piano sheet sample, read from disk only when it is first requested
+SAMPLE_PATH = Path(__file__).parent / "assets" / "piano_sample.ly"
+
+@st.cache_data(show_spinner=False)
+def _load_sample():
+    """Return the bundled piano sample score."""
+    return SAMPLE_PATH.read_text(encoding="utf-8")
+
+def _clear_generated_files():
+    """Hide the download buttons once the input no longer matches them."""
+    st.session_state.downloads = []
+    # Also drop a pending conversion of the old input; one already running
+    # still fills the disk cache, but its result is no longer shown
+    future = st.session_state.get('convert_future')
+    if future is not None:
+        future.cancel()
+    st.session_state.convert_future = None
+    st.session_state.convert_progress = []
 
-# Piano sheet sample
-piano_sheet = r"""\version "2.20.0"
-
-\header {
-  title = "Ascension"
-  subtitle = "An Epic Piano Journey"
-  composer = "Composed for You"
-}
-
-\paper {
-  #(set-paper-size "letter")
-}
-
-global = {
-  \key d \major
-  \time 4/4
-  \tempo "With passion" 4 = 72
-}
-
-upper = \relative c'' {
-  \global
-  \clef treble
-  
-  % Introduction - Majestic and contemplative
-  \partial 4 a4\mp |
-  <d fis a>2. <cis e a>4 |
-  <b d g>2. <a d fis>4 |
-  <g b e>2 <fis a d>2 |
-  <e a cis>2. a,4\< |
-  
-  <d fis a>2.\mf <e g b>4 |
-  <fis a d>2. <g b e>4 |
-  <a cis e>2 <b d fis>2 |
-  <a cis e>2. r4\! |
-  
-  % Main theme - Hopeful and building
-  d,4\mp\< fis a d |
-  cis4. b8 a4 fis |
-  b4. a8 g4 d |
-  e4. fis8 g4\mf a\> |
-  
-  d,4\mp fis a d |
-  e4. d8 cis4 a |
-  b4. a8 g4 e |
-  fis2\> d2\mp\! |
-  
-  % First few measures of the piece for brevity
-  \bar "|."
-}
-
-lower = \relative c {
-  \global
-  \clef bass
-  
-  % Introduction
-  \partial 4 r4 |
-  d4 a' d, a' |
-  g,4 d' g, d' |
-  e,4 b' e, b' |
-  a,4 e' a, e' |
-  
-  d4 a' d, a' |
-  d,4 a' d, a' |
-  a,4 e' a, e' |
-  a,4 e' a, e' |
-  
-  % Main theme
-  d4 a' fis a |
-  a,4 e' a, e' |
-  g,4 d' g, d' |
-  a4 e' a, e' |
-  
-  d4 a' fis a |
-  a,4 e' a, e' |
-  g,4 d' g, d' |
-  a4 d fis a |
-  
-  \bar "|."
-}
-
-\score {
-  \new PianoStaff <<
-    \new Staff = "upper" \upper
-    \new Staff = "lower" \lower
-  >>
-  \layout { }
-  \midi { }
-}"""
+def _set_text_input(lily_text):
+    """Replace the Text Input tab's code and clear previous generated files."""
+    # Runs from button callbacks, before the text area is created, which is
+    # when Streamlit allows its state to be set
+    st.session_state.ly_text = lily_text
+    _clear_generated_files()
+
+def _read_download(path):
+    """Read a generated file for its download button; empty if it was evicted."""
+    try:
+        return Path(path).read_bytes()
+    except FileNotFoundError:
+        # Another session's conversion evicted it from the disk cache; the
+        # rerun after the click tells the user to convert again
+        return b""
+
+def _render_download_ui():
+    """Show the download buttons for the most recent conversion."""
+    st.success("Files generated successfully!")
+    
+    # Create a download button per generated file; Streamlit calls data only
+    # when the button is clicked, so the file is not read on every rerun
+    for label, path, file_name, mime in st.session_state.downloads:
+        st.download_button(
+            label=label,
+            data=lambda path=path: _read_download(path),
+            file_name=file_name,
+            mime=mime,
+            key=label
+        )
+    
+    st.info("PDF preview is not available due to browser security restrictions. Please download the PDF to view it.")
+
+def _convert_score(ly_content, output_name, lilypond_path):
+    """Convert one score; returns (downloads, error_message)."""
+    pdf_path, pdf_filename, midi_path, midi_filename, error = convert_lilypond_to_files(
+        ly_content, output_name, lilypond_path
+    )
+    if error:
+        return None, error
+    
+    downloads = [("Download PDF", pdf_path, pdf_filename, "application/octet-stream")]
+    if midi_path is not None:
+        downloads.append(("Download MIDI", midi_path, midi_filename, "audio/midi"))
+    return downloads, None
+
+def _convert_scores(sources, archive_name, lilypond_path, report_progress):
+    """Convert several scores into one ZIP; returns (downloads, error_message)."""
+    zip_path, zip_filename, error = convert_batch_to_zip(
+        sources, archive_name, lilypond_path, on_progress=report_progress
+    )
+    if error:
+        return None, error
+    return [("Download ZIP", zip_path, zip_filename, "application/zip")], None
+
+def _do_convert(convert, *args, track_progress=False):
+    """Start a conversion on the worker pool."""
+    # A newer request supersedes the pending one; drop it if it has not started
+    # yet so repeated clicks do not pile up jobs and their sources in the pool
+    previous = st.session_state.convert_future
+    if previous is not None:
+        previous.cancel()
+    
+    # Workers append the fraction done; list.append is safe across threads
+    progress = st.session_state.convert_progress = []
+    
+    # The Future is kept in session state so later reruns can collect the result
+    if track_progress:
+        args += (lilypond_path, progress.append)
+    else:
+        args += (lilypond_path,)
+    st.session_state.convert_future = _get_executor().submit(convert, *args)
+
+# Keyed on the upload's file_id alone (underscored arguments are not hashed),
+# so each upload is decoded and scanned once rather than on every rerun
+@st.cache_data(show_spinner=False, max_entries=64)
+def _upload_title(file_id, _content):
+    """Header title of an uploaded score, or None."""
+    return extract_title_from_lilypond(_content.decode("utf-8"))
+
+def _upload_output_name(uploaded_file):
+    """Default output name for an upload: its header title, else its file name."""
+    extracted_title = _upload_title(uploaded_file.file_id, uploaded_file.getvalue())
+    if extracted_title:
+        return extracted_title
+    # Use filename if no title in header
+    return os.path.splitext(uploaded_file.name)[0]
+
+def _on_upload_change():
+    """Clear previous generated files and suggest an output name for the new upload."""
+    _clear_generated_files()
+    # A keyed widget ignores later changes to its value argument, so the
+    # default name is written to its state instead
+    uploaded = st.session_state.uploaded_files
+    if len(uploaded) == 1:
+        st.session_state.file_output = _upload_output_name(uploaded[0])
+    elif uploaded:
+        st.session_state.file_output = "scores"
+    else:
+        st.session_state.file_output = "output"
 
 # Create tabs
-tab1, tab2, tab3 = st.tabs(["Input Text", "Upload File", "MIDI to LilyPond"])
-
-# Initialize session state for storing generated files
-if 'pdf_generated' not in st.session_state:
-    st.session_state.pdf_generated = False
-if 'pdf_data' not in st.session_state:
-    st.session_state.pdf_data = None
-if 'pdf_filename' not in st.session_state:
-    st.session_state.pdf_filename = None
-if 'midi_data' not in st.session_state:
-    st.session_state.midi_data = None
-if 'midi_filename' not in st.session_state:
-    st.session_state.midi_filename = None
-if 'ly_text' not in st.session_state:
-    st.session_state.ly_text = ''
+tab1, tab2, tab3 = st.tabs(TAB_LABELS)
+
+# Initialize session state for storing generated files; an empty downloads
+# list means nothing has been generated for the current input
+for key, default in (
+    ('downloads', []),
+    ('ly_text', ''),
+    ('convert_future', None),
+    ('convert_progress', []),
+    ('file_output', 'output'),
+):
+    st.session_state.setdefault(key, default)
 
 with tab1:
     # Text input area
     st.subheader("Enter LilyPond Notation")
     
     # Button to load sample
-    if st.button("Load Sample"):
-        ly_text = piano_sheet
-        # Clear previous generated files when loading new content
-        st.session_state.pdf_generated = False
-    else:
-        ly_text = st.session_state.get('ly_text', '')
-    
-    text_area = st.text_area("LilyPond Code", value=ly_text, height=400)
+    st.button("Load Sample", on_click=lambda: _set_text_input(_load_sample()))
     
-    # Clear previous generated files if text changes
-    if 'ly_text' in st.session_state and st.session_state.ly_text != text_area:
-        st.session_state.pdf_generated = False
-    
-    st.session_state['ly_text'] = text_area
+    # The text lives in st.session_state.ly_text; clear previous generated
+    # files when the user edits it
+    text_area = st.text_area("LilyPond Code", key='ly_text', height=400,
+                             on_change=_clear_generated_files)
     
     # Try to extract title from the LilyPond code for the default filename
     extracted_title = extract_title_from_lilypond(text_area)
@@ -295,33 +270,72 @@ with tab1:
 
 with tab2:
     # File upload
-    st.subheader("Upload LilyPond File")
-    uploaded_file = st.file_uploader("Choose a LilyPond file", type=['ly'])
+    st.subheader("Upload LilyPond Files")
     
-    # Clear previous generated files if a new file is uploaded
-    if uploaded_file is not None and 'last_uploaded_file' in st.session_state:
-        if st.session_state.last_uploaded_file != uploaded_file.name:
-            st.session_state.pdf_generated = False
-            st.session_state.last_uploaded_file = uploaded_file.name
-    elif uploaded_file is not None:
-        st.session_state.last_uploaded_file = uploaded_file.name
+    # Clear previous generated files if new files are uploaded
+    uploaded_files = st.file_uploader("Choose LilyPond files", type=['ly'],
+                                      accept_multiple_files=True, key="uploaded_files",
+                                      on_change=_on_upload_change)
     
-    # Output options for file upload
-    if uploaded_file is not None:
-        # Try to extract title from the uploaded file
-        uploaded_content = uploaded_file.getvalue().decode("utf-8")
-        extracted_title = extract_title_from_lilypond(uploaded_content)
-        if extracted_title:
-            default_name = extracted_title
-        else:
-            # Use filename if no title in header
-            default_name = os.path.splitext(uploaded_file.name)[0]
-    else:
-        default_name = "output"
+    # Output options for file upload; the default name is set on upload
+    if len(uploaded_files) > 1:
+        st.info(f"{len(uploaded_files)} files will be converted and bundled into a ZIP archive.")
         
-    output_filename_file = st.text_input("Output Filename", value=default_name, key="file_output")
+    output_filename_file = st.text_input("Output Filename", key="file_output")
 
-with tab3:
+def _copy_to_text_input(lily_text):
+    """Send code generated in the MIDI tab to the Text Input tab."""
+    _set_text_input(lily_text)
+    st.toast("LilyPond code copied to the Text Input tab!")
+    # Clicks inside the fragment only rerun the fragment; ask for a full rerun
+    # so the Text Input tab shows the new code
+    st.session_state.rerun_app = True
+
+# Parsing with music21 takes seconds, so the result is kept per MIDI file;
+# enhancement, title and composer are applied afterwards, so changing them
+# does not parse the file again
+@st.cache_data(show_spinner=False, max_entries=8)
+def _midi_to_lilypond(midi_data, analyze_structure):
+    """Convert MIDI data to LilyPond code; returns (lily_text, section_count)."""
+    # music21 is imported here because loading it takes seconds and most
+    # sessions never need it
+    import music21
+    
+    # Save the uploaded MIDI file temporarily
+    with tempfile.NamedTemporaryFile(suffix='.mid', delete=False) as temp_file:
+        temp_path = temp_file.name
+        temp_file.write(midi_data)
+    lily_output_path = temp_path + '.ly'
+    
+    try:
+        score = music21.converter.parse(temp_path)
+        
+        # Optionally analyze the structure
+        section_count = None
+        if analyze_structure:
+            section_count = len(analyze_musical_structure(score))
+        
+        # Write the LilyPond file and read it back
+        score.write('lily', lily_output_path)
+        with open(lily_output_path, 'r') as f:
+            lily_text = f.read()
+    finally:
+        # Clean up temporary files, also when parsing fails
+        for path in (temp_path, lily_output_path):
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+    
+    return lily_text, section_count
+
+# The MIDI tab only depends on its own widgets, so run it as a fragment:
+# interacting with it reruns just this function instead of the whole app
+@st.fragment
+def _midi_to_lilypond_tab():
+    if st.session_state.pop('rerun_app', False):
+        st.rerun()
+    
     st.subheader("Convert MIDI to LilyPond")
     uploaded_midi = st.file_uploader("Upload a MIDI file", type=['mid', 'midi'])
     
@@ -347,193 +361,98 @@ with tab3:
             status_container.info("Starting conversion...")
             
             try:
-                # Save the uploaded MIDI file temporarily
-                with tempfile.NamedTemporaryFile(suffix='.mid', delete=False) as temp_file:
-                    temp_path = temp_file.name
-                    temp_file.write(uploaded_midi.getvalue())
-                
                 # Use music21 to convert MIDI to LilyPond
-                score = music21.converter.parse(temp_path)
-                
-                # Optionally analyze the structure
-                if analyze_structure:
-                    sections = analyze_musical_structure(score)
-                    status_container.info(f"Found {len(sections)} musical sections")
-                
-                # Create a temporary file for LilyPond output
-                lily_output_path = temp_path + '.ly'
-                score.write('lily', lily_output_path)
+                lily_text, section_count = _midi_to_lilypond(
+                    uploaded_midi.getvalue(), analyze_structure
+                )
                 
-                # Read the generated LilyPond file
-                with open(lily_output_path, 'r') as f:
-                    lily_text = f.read()
-                
-                # Enhance the output if requested
+                # Enhance the output if requested, with the title and composer
+                # from the user input
                 if enhance_output:
-                    lily_text = enhance_lilypond_output(lily_text)
-                    
-                    # Replace title and composer with user input
-                    lily_text = re.sub(r'title = "[^"]*"', f'title = "{title}"', lily_text)
-                    lily_text = re.sub(r'composer = "[^"]*"', f'composer = "{composer}"', lily_text)
-                
-                # Clean up temporary files
-                os.unlink(temp_path)
-                os.unlink(lily_output_path)
+                    lily_text = enhance_lilypond_output(lily_text, title, composer)
                 
-                # Clear status
-                status_container.empty()
+                # Clear status, leaving the structure analysis result if any
+                if section_count is not None:
+                    status_container.info(f"Found {section_count} musical sections")
+                else:
+                    status_container.empty()
                 
                 # Display the LilyPond notation
                 st.subheader("Generated LilyPond Notation")
                 st.text_area("Copy this code:", value=lily_text, height=400)
                 
                 # Add button to copy to the text input tab
-                if st.button("Use this in the Text Input Tab", key="use_in_text_input"):
-                    st.session_state['ly_text'] = lily_text
-                    st.info("LilyPond code copied to the Text Input tab!")
+                st.button("Use this in the Text Input Tab", key="use_in_text_input",
+                          on_click=_copy_to_text_input, args=(lily_text,))
                 
             except Exception as e:
                 st.error(f"Error during conversion: {str(e)}")
                 st.error("Detailed error information:")
                 st.code(traceback.format_exc())
 
-# Display download buttons if files have been generated
-if st.session_state.pdf_generated:
-    st.success("Files generated successfully!")
-    
-    # Create download buttons for both PDF and MIDI
-    if st.session_state.pdf_data is not None:
-        st.download_button(
-            label="Download PDF",
-            data=st.session_state.pdf_data,
-            file_name=st.session_state.pdf_filename,
-            mime="application/octet-stream",
-            key="pdf_download"
-        )
-    
-    if st.session_state.midi_data is not None:
-        st.download_button(
-            label="Download MIDI",
-            data=st.session_state.midi_data,
-            file_name=st.session_state.midi_filename,
-            mime="audio/midi",
-            key="midi_download"
-        )
-    
-    st.info("PDF preview is not available due to browser security restrictions. Please download the PDF to view it.")
+with tab3:
+    _midi_to_lilypond_tab()
+
+# Files live in the converter's disk cache and may have been evicted since
+if not all(os.path.exists(path) for _, path, _, _ in st.session_state.downloads):
+    st.session_state.downloads = []
+    st.warning("The generated files are no longer available. Please convert again.")
+
+# Display download buttons if files have been generated; the placeholder is
+# also filled in directly when a conversion finishes further down
+download_area = st.empty()
+if st.session_state.downloads:
+    with download_area.container():
+        _render_download_ui()
 
 # Convert buttons
-convert_text = st.button("Convert to PDF", key="convert_text", disabled=not lilypond_path)
-convert_file = st.button("Convert to PDF", key="convert_file", disabled=not lilypond_path or uploaded_file is None)
+convert_text = st.button("Convert to PDF", key="convert_text", disabled=not lilypond_path,
+                         on_click=_clear_generated_files)
+convert_file = st.button("Convert to PDF", key="convert_file", disabled=not lilypond_path or not uploaded_files,
+                         on_click=_clear_generated_files)
 
 # Processing logic
-if (convert_text or convert_file) and lilypond_path:
+if convert_text and lilypond_path:
+    _do_convert(_convert_score, text_area, output_filename)
+elif convert_file and lilypond_path:
+    # Pass the uploaded bytes through as-is; LilyPond reads UTF-8 itself
+    if len(uploaded_files) == 1:
+        _do_convert(_convert_score, uploaded_files[0].getvalue(), output_filename_file)
+    else:
+        sources = [(_upload_output_name(f), f.getvalue()) for f in uploaded_files]
+        _do_convert(_convert_scores, sources, output_filename_file, track_progress=True)
+
+# Wait for a pending conversion, including one started before the last rerun
+if st.session_state.convert_future is not None:
     # Create a status container
     status_container = st.empty()
-    status_container.info("Starting conversion...")
-    
-    try:
-        # Create a temporary directory
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Get LilyPond content
-            if convert_text:
-                ly_content = text_area
-                output_name = output_filename
-            else:  # convert_file
-                if uploaded_file is None:
-                    st.error("Please upload a LilyPond file.")
-                    st.stop()
-                    
-                # Read uploaded file
-                ly_content = uploaded_file.getvalue().decode("utf-8")
-                output_name = output_filename_file
-            
-            # Create temporary LilyPond file
-            temp_ly_path = os.path.join(temp_dir, "score.ly")
-            with open(temp_ly_path, 'w') as f:
-                f.write(ly_content)
-            
-            # Run LilyPond
+    future = st.session_state.convert_future
+    progress = st.session_state.convert_progress
+    
+    # Updating the status between short waits lets Streamlit interrupt this
+    # run when the user interacts with another widget
+    while not future.done():
+        if progress:
+            status_container.progress(progress[-1], text="Running LilyPond...")
+        else:
             status_container.info("Running LilyPond...")
-            result = subprocess.run(
-                [lilypond_path, '--output=' + temp_dir, temp_ly_path],
-                capture_output=True,
-                text=True
-            )
-            
-            if result.returncode != 0:
-                status_container.error(f"LilyPond Error: {result.stderr}")
-                st.stop()
-            
-            # Check if PDF was generated
-            temp_pdf_path = os.path.join(temp_dir, "score.pdf")
-            if not os.path.exists(temp_pdf_path):
-                status_container.error("LilyPond did not generate a PDF.")
-                st.stop()
-            
-            # Copy to a more permanent location within the streamlit cache
-            cache_dir = os.path.join(tempfile.gettempdir(), "streamlit_lilypond_cache")
-            os.makedirs(cache_dir, exist_ok=True)
-            final_pdf_path = os.path.join(cache_dir, f"{output_name}.pdf")
-            
-            import shutil
-            shutil.copy2(temp_pdf_path, final_pdf_path)
-            
-            # Store PDF data in session state
-            with open(final_pdf_path, "rb") as pdf_file:
-                pdf_data = pdf_file.read()
-                st.session_state.pdf_data = pdf_data
-                st.session_state.pdf_filename = f"{output_name}.pdf"
-            
-            # Also generate MIDI if available
-            temp_midi_path = os.path.join(temp_dir, "score.midi")
-            if os.path.exists(temp_midi_path):
-                final_midi_path = os.path.join(cache_dir, f"{output_name}.midi")
-                shutil.copy2(temp_midi_path, final_midi_path)
-                
-                with open(final_midi_path, "rb") as midi_file:
-                    midi_data = midi_file.read()
-                    st.session_state.midi_data = midi_data
-                    st.session_state.midi_filename = f"{output_name}.midi"
-            else:
-                st.session_state.midi_data = None
-                st.session_state.midi_filename = None
-            
-            # Mark as successful
-            st.session_state.pdf_generated = True
-            
-            # Remove status message as we'll show success in the permanent UI
-            status_container.empty()
-            
-            # Force a rerun to show the download buttons
-            st.rerun()
+        wait([future], timeout=0.5)
+    
+    st.session_state.convert_future = None
+    downloads, error = future.result()
     
-    except Exception as e:
-        st.error(f"Error during conversion: {str(e)}")
+    if error:
+        status_container.error(error)
+        st.stop()
+    
+    # Store the locations of the generated files in session state
+    st.session_state.downloads = downloads
+    
+    # Remove status message and show the download buttons without a rerun
+    status_container.empty()
+    with download_area.container():
+        _render_download_ui()
 
 # Footer with instructions
 st.markdown("---")
-st.markdown("""
-### How to Use This App
-1. **Input Text Tab**: Enter LilyPond notation directly
-   - Paste your LilyPond code or use the sample
-   - Set your output filename
-   - Click "Convert to PDF"
-
-2. **Upload File Tab**: Upload an existing LilyPond file
-   - Upload your .ly file
-   - Set your output filename
-   - Click "Convert to PDF"
-
-3. **MIDI to LilyPond Tab**: Convert MIDI files to LilyPond notation
-   - Upload a MIDI file
-   - Configure conversion options
-   - Click "Convert MIDI to LilyPond"
-   - Optionally send the generated code to the Text Input tab
-
-4. Download the generated PDF and MIDI files
-
-### About LilyPond
-[LilyPond](https://lilypond.org/) is an open-source music engraving program that produces beautiful sheet music.
-This app requires LilyPond to be installed on the server where Streamlit is running.
-""")
\ No newline at end of file
+st.markdown(HOWTO_MD)
\ No newline at end of file
@@ -1,62 +1,385 @@
+import hashlib
+import logging
 import os
+import shutil
 import tempfile
+import time
 import subprocess
-import shutil
+import threading
+import zipfile
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+logger = logging.getLogger(__name__)
+
+# Generated files are stored under a hash of the LilyPond source so identical
+# scores are only engraved once, even across sessions and restarts. They are
+# kept uncompressed: LilyPond already deflates PDF streams, MIDI files are tiny,
+# and the download buttons serve the cached files directly by path.
+# LILYPOND_CACHE_DIR can point it at storage that outlives the temp directory.
+CACHE_DIR = os.environ.get(
+    "LILYPOND_CACHE_DIR", os.path.join(tempfile.gettempdir(), "streamlit_lilypond_cache")
+)
+MAX_CACHE_ENTRIES = 200
+MAX_CACHE_BYTES = 50 * 1024 * 1024
+
+# Scratch files and directories in the cache older than this were left behind
+# by a conversion that was killed before it could clean up
+STALE_SCRATCH_SECONDS = 24 * 60 * 60
+
+# Only produce what is read back: a PDF without point-and-click links (which
+# add work and size), MIDI under the same .midi name on every platform, and
+# only the warnings and errors shown to the user, not progress messages
+LILYPOND_ARGS = ('-dno-point-and-click', '-dmidi-extension=midi', '--pdf', '--loglevel=WARN')
+
+# Seconds a single score may take before LilyPond is killed, so a runaway
+# score cannot hold a worker forever
+LILYPOND_TIMEOUT = 120
+
+# Scores engraved by one LilyPond process in a batch; few enough that a batch
+# of ordinary scores finishes within LILYPOND_TIMEOUT
+MAX_BATCH_SCORES = 4
+
+def _cache_key(data, *context):
+    """Return the hash of data and any context strings, used to name cached files."""
+    digest = hashlib.blake2b(data, digest_size=16)
+    for part in context:
+        digest.update(b"\0" + part.encode("utf-8"))
+    return digest.hexdigest()
+
+def _cached_paths(source, lilypond_path):
+    """Return the cached PDF and MIDI paths for the encoded LilyPond source."""
+    # Output also depends on the LilyPond install and flags, so a changed
+    # binary or option set does not serve stale engravings
+    key = _cache_key(source, lilypond_path, *LILYPOND_ARGS)
+    return os.path.join(CACHE_DIR, f"{key}.pdf"), os.path.join(CACHE_DIR, f"{key}.midi")
+
+def _run_lilypond(lilypond_path, output, inputs, source=None):
+    """
+    Run LilyPond on the input paths ('-' reads source from stdin) and capture its stderr.
+    Raises subprocess.TimeoutExpired, after killing LilyPond, if it runs longer
+    than LILYPOND_TIMEOUT, however many inputs it has.
+    """
+    return subprocess.run(
+        [lilypond_path, *LILYPOND_ARGS, '--output=' + output, *inputs],
+        input=source,
+        # Only stderr is reported; with --loglevel=WARN it holds just the
+        # warnings and errors, so it stays small
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        env={**os.environ, 'GUILE_AUTO_COMPILE': '0'},
+        # A fixed limit, so a hung score in a batch holds its worker no longer
+        # than a single conversion would; the batch then falls back to
+        # converting its sources one by one
+        timeout=LILYPOND_TIMEOUT
+    )
+
+def _evict_cache(cache_dir, keep=(), max_entries=MAX_CACHE_ENTRIES, max_bytes=MAX_CACHE_BYTES):
+    """
+    Remove the least recently used entries once the cache exceeds max_entries or max_bytes.
+    Entries whose PDF or ZIP path is in keep are still needed by the caller and never removed.
+    """
+    keep_stems = {os.path.splitext(path)[0] for path in keep}
+    entries = []
+    midi_sizes = {}
+    for entry in os.scandir(cache_dir):
+        stem, extension = os.path.splitext(entry.path)
+        # Other sessions evict concurrently, so entries can vanish mid-scan
+        try:
+            if extension in (".pdf", ".zip"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stem, entry.path, stat.st_size))
+            elif extension == ".midi":
+                midi_sizes[stem] = entry.stat().st_size
+        except FileNotFoundError:
+            pass
+
+    total_bytes = sum(entry[3] for entry in entries) + sum(midi_sizes.values())
+    remaining = len(entries)
+
+    # Oldest first; the newest entry is always kept, even if it alone is over budget
+    entries.sort()
+    for _, stem, path, size in entries[:-1]:
+        if remaining <= max_entries and total_bytes <= max_bytes:
+            break
+        if stem in keep_stems:
+            continue
+        for cached_path in (path, stem + ".midi"):
+            try:
+                os.remove(cached_path)
+            except FileNotFoundError:
+                pass
+        total_bytes -= size + midi_sizes.get(stem, 0)
+        remaining -= 1
+
+def sweep_cache():
+    """
+    Prepare the output cache when the app starts: create it, remove scratch
+    files left by interrupted conversions, and apply the size limits.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cutoff = time.time() - STALE_SCRATCH_SECONDS
+    for entry in os.scandir(CACHE_DIR):
+        if entry.name.endswith((".pdf", ".midi", ".zip")):
+            continue
+        try:
+            if entry.stat(follow_symlinks=False).st_mtime > cutoff:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            else:
+                os.remove(entry.path)
+        except FileNotFoundError:
+            pass
+    _evict_cache(CACHE_DIR)
+
+def convert_lilypond_to_files(lily_content, output_name, lilypond_path):
+    """
+    Convert LilyPond content to PDF and MIDI files in the output cache.
+    lily_content may be a str or UTF-8 encoded bytes (e.g. an uploaded file).
+    Returns tuple of (pdf_path, pdf_filename, midi_path, midi_filename, error_message).
+    On failure the first four entries are None; on success error_message is None.
+    """
+    return _convert_to_cache(lily_content, output_name, lilypond_path, evict=True)
+
+def _convert_to_cache(lily_content, output_name, lilypond_path, evict):
+    """
+    convert_lilypond_to_files, optionally without cache eviction; batches
+    evict once their archive is written so no member is removed before then.
+    """
+    try:
+        if isinstance(lily_content, str):
+            source = lily_content.encode("utf-8")
+        else:
+            source = lily_content
+
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        cached_pdf_path, cached_midi_path = _cached_paths(source, lilypond_path)
+
+        try:
+            # Mark the entry as recently used for eviction; another session may
+            # have evicted it since, which is a cache miss
+            os.utime(cached_pdf_path)
+            cached = True
+        except FileNotFoundError:
+            cached = False
+
+        if not cached:
+            # Create a temporary directory next to the cache entries, so finished
+            # files can be renamed into place instead of copied
+            with tempfile.TemporaryDirectory(dir=CACHE_DIR) as temp_dir:
+                # Run LilyPond, feeding the source on stdin ('-') rather than
+                # through a temporary .ly file; output is named score.*
+                result = _run_lilypond(
+                    lilypond_path, os.path.join(temp_dir, "score"), ['-'], source
+                )
+
+                if result.returncode != 0:
+                    stderr = result.stderr.decode("utf-8", errors="replace")
+                    return None, None, None, None, f"LilyPond Error: {stderr}"
+
+                # Check if PDF was generated
+                temp_pdf_path = os.path.join(temp_dir, "score.pdf")
+                if not os.path.exists(temp_pdf_path):
+                    return None, None, None, None, "LilyPond did not generate a PDF."
+
+                # Move the MIDI first so a cached PDF always implies a complete entry
+                temp_midi_path = os.path.join(temp_dir, "score.midi")
+                if os.path.exists(temp_midi_path):
+                    os.replace(temp_midi_path, cached_midi_path)
+                os.replace(temp_pdf_path, cached_pdf_path)
+
+            if evict:
+                _evict_cache(CACHE_DIR, keep=(cached_pdf_path,))
+
+        # Check for MIDI
+        if not os.path.exists(cached_midi_path):
+            return cached_pdf_path, f"{output_name}.pdf", None, None, None
+
+        return cached_pdf_path, f"{output_name}.pdf", cached_midi_path, f"{output_name}.midi", None
+
+    except subprocess.TimeoutExpired:
+        return None, None, None, None, f"LilyPond did not finish within {LILYPOND_TIMEOUT} seconds."
+    except Exception as e:
+        return None, None, None, None, f"Error during conversion: {str(e)}"
 
 def convert_lilypond_to_pdf_midi(lily_content, output_name, lilypond_path):
     """
     Convert LilyPond content to PDF and MIDI files.
-    Returns tuple of (pdf_data, pdf_filename, midi_data, midi_filename) or (None, error_message)
+    Returns tuple of (pdf_data, pdf_filename, midi_data, midi_filename, error_message).
+    On failure the first four entries are None; on success error_message is None.
+    """
+    pdf_path, pdf_filename, midi_path, midi_filename, error = convert_lilypond_to_files(
+        lily_content, output_name, lilypond_path
+    )
+    if error:
+        return None, None, None, None, error
+
+    try:
+        # Read PDF data. The two reads stay sequential: they are single reads of
+        # small, freshly cached files, cheaper than starting worker threads
+        pdf_data = Path(pdf_path).read_bytes()
+
+        # Read MIDI data if the score produced any
+        midi_data = None
+        if midi_path is not None:
+            midi_data = Path(midi_path).read_bytes()
+
+        return pdf_data, pdf_filename, midi_data, midi_filename, None
+
+    except Exception as e:
+        return None, None, None, None, f"Error during conversion: {str(e)}"
+
+def _engrave_batch(sources, lilypond_path):
+    """
+    Engrave several encoded LilyPond sources with a single LilyPond process
+    and move the results into the output cache.
+    Nothing is cached if LilyPond reports an error, since it cannot be traced
+    to one source; callers then convert each source on its own.
+    Returns the sources that were cached.
+    """
+    with tempfile.TemporaryDirectory(dir=CACHE_DIR) as temp_dir:
+        ly_paths = []
+        for index, source in enumerate(sources):
+            ly_path = os.path.join(temp_dir, f"score{index}.ly")
+            Path(ly_path).write_bytes(source)
+            ly_paths.append(ly_path)
+
+        result = _run_lilypond(lilypond_path, temp_dir, ly_paths)
+        if result.returncode != 0:
+            return []
+
+        cached = []
+        for ly_path, source in zip(ly_paths, sources):
+            stem = os.path.splitext(ly_path)[0]
+            if not os.path.exists(stem + ".pdf"):
+                continue
+            cached_pdf_path, cached_midi_path = _cached_paths(source, lilypond_path)
+            if os.path.exists(stem + ".midi"):
+                os.replace(stem + ".midi", cached_midi_path)
+            os.replace(stem + ".pdf", cached_pdf_path)
+            cached.append(source)
+        return cached
+
+def convert_batch_to_zip(sources, archive_name, lilypond_path, on_progress=None):
+    """
+    Convert several LilyPond sources in parallel and bundle the results in a ZIP.
+    sources is a list of (output_name, lily_content) pairs.
+    on_progress, if given, is called from worker threads with the fraction of
+    sources converted so far.
+    Returns tuple of (zip_path, zip_filename, error_message).
     """
+    workers = min(len(sources), os.cpu_count() or 2)
+    encoded = [
+        content.encode("utf-8") if isinstance(content, str) else content
+        for _, content in sources
+    ]
+
+    # Count the sources that are not cached yet, per distinct source
+    missing = {}
+    for source in encoded:
+        if not os.path.exists(_cached_paths(source, lilypond_path)[0]):
+            missing[source] = missing.get(source, 0) + 1
+
+    done = 0
+    progress_lock = threading.Lock()
+
+    def report(count):
+        """Add count converted sources to the progress."""
+        nonlocal done
+        with progress_lock:
+            done += count
+            if on_progress:
+                on_progress(done / len(sources))
+
+    report(len(sources) - sum(missing.values()))
+
     try:
-        # Create a temporary directory
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Create temporary LilyPond file
-            temp_ly_path = os.path.join(temp_dir, "score.ly")
-            with open(temp_ly_path, 'w') as f:
-                f.write(lily_content)
-            
-            # Run LilyPond
-            result = subprocess.run(
-                [lilypond_path, '--output=' + temp_dir, temp_ly_path],
-                capture_output=True,
-                text=True
-            )
-            
-            if result.returncode != 0:
-                return None, None, None, None, f"LilyPond Error: {result.stderr}"
-            
-            # Check if PDF was generated
-            temp_pdf_path = os.path.join(temp_dir, "score.pdf")
-            if not os.path.exists(temp_pdf_path):
-                return None, None, None, None, "LilyPond did not generate a PDF."
-            
-            # Copy to a more permanent location within the streamlit cache
-            cache_dir = os.path.join(tempfile.gettempdir(), "streamlit_lilypond_cache")
-            os.makedirs(cache_dir, exist_ok=True)
-            final_pdf_path = os.path.join(cache_dir, f"{output_name}.pdf")
-            
-            shutil.copy2(temp_pdf_path, final_pdf_path)
-            
-            # Read PDF data
-            with open(final_pdf_path, "rb") as pdf_file:
-                pdf_data = pdf_file.read()
-                pdf_filename = f"{output_name}.pdf"
-            
-            # Check for MIDI
-            midi_data = None
-            midi_filename = None
-            
-            temp_midi_path = os.path.join(temp_dir, "score.midi")
-            if os.path.exists(temp_midi_path):
-                final_midi_path = os.path.join(cache_dir, f"{output_name}.midi")
-                shutil.copy2(temp_midi_path, final_midi_path)
-                
-                with open(final_midi_path, "rb") as midi_file:
-                    midi_data = midi_file.read()
-                    midi_filename = f"{output_name}.midi"
-            
-            return pdf_data, pdf_filename, midi_data, midi_filename, None
-    
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # LilyPond start-up (Guile and font loading) often costs more than a
+        # short score, so workers engrave several scores per process, in
+        # batches small enough to finish within the timeout
+        if missing:
+            distinct = list(missing)
+            batch_count = max(min(workers, len(distinct)), -(-len(distinct) // MAX_BATCH_SCORES))
+            batches = [distinct[i::batch_count] for i in range(batch_count)]
+            with ThreadPoolExecutor(max_workers=min(workers, batch_count)) as executor:
+                futures = [executor.submit(_engrave_batch, batch, lilypond_path) for batch in batches]
+                for future in as_completed(futures):
+                    try:
+                        cached = future.result()
+                    except (OSError, subprocess.SubprocessError):
+                        # Sources a failed batch left uncached are converted
+                        # and counted below
+                        logger.warning("Batch engraving failed; converting its sources one by one",
+                                       exc_info=True)
+                        continue
+                    for source in cached:
+                        report(missing.pop(source))
+    except OSError:
+        # Anything left uncached is converted one by one below
+        logger.warning("Batch engraving failed; converting sources one by one", exc_info=True)
+
+    # Mostly cache hits now; a source from a failed batch is engraved again on
+    # its own so its error is reported against it
+    def convert(index):
+        result = _convert_to_cache(encoded[index], sources[index][0], lilypond_path, evict=False)
+        if encoded[index] in missing:
+            report(1)
+        return result
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(convert, range(len(sources))))
+
+    errors = [f"{name}: {result[4]}" for (name, _), result in zip(sources, results) if result[4]]
+    if errors:
+        return None, None, "\n".join(errors)
+
+    try:
+        # Collect archive members, numbering repeated names so none are overwritten
+        members = []
+        used_stems = set()
+        for pdf_path, pdf_filename, midi_path, midi_filename, _ in results:
+            base = stem = os.path.splitext(pdf_filename)[0]
+            # A numbered name may itself belong to another score, e.g. Song_1
+            count = 1
+            while stem in used_stems:
+                stem = f"{base}_{count}"
+                count += 1
+            used_stems.add(stem)
+            members.append((pdf_path, f"{stem}.pdf"))
+            if midi_path is not None:
+                members.append((midi_path, f"{stem}.midi"))
+
+        # The cached file paths already encode the sources, so they key the archive
+        key = _cache_key("\0".join(f"{path}\0{name}" for path, name in members).encode("utf-8"))
+        zip_path = os.path.join(CACHE_DIR, f"{key}.zip")
+
+        try:
+            os.utime(zip_path)
+            cached = True
+        except FileNotFoundError:
+            cached = False
+
+        if not cached:
+            # Sessions share the process, so each writer gets its own temporary file
+            temp_fd, temp_zip_path = tempfile.mkstemp(dir=CACHE_DIR, suffix=".tmp")
+            try:
+                # PDF and MIDI are already compressed, so store them as-is
+                with os.fdopen(temp_fd, 'wb') as temp_file:
+                    with zipfile.ZipFile(temp_file, 'w', zipfile.ZIP_STORED) as archive:
+                        for path, name in members:
+                            archive.write(path, name)
+                os.replace(temp_zip_path, zip_path)
+            finally:
+                # Only left behind if the archive could not be completed
+                try:
+                    os.remove(temp_zip_path)
+                except FileNotFoundError:
+                    pass
+            _evict_cache(CACHE_DIR, keep=(zip_path,))
+
+        return zip_path, f"{archive_name}.zip", None
+
     except Exception as e:
-        return None, None, None, None, f"Error during conversion: {str(e)}"
\ No newline at end of file
+        return None, None, f"Error during conversion: {str(e)}"
\ No newline at end of file
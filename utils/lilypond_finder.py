@@ -1,17 +1,26 @@
 import os
-import subprocess
+import shutil
+import stat
 import platform
+from functools import lru_cache
 
+def _is_executable_file(path):
+    """Check with a single stat call that path is an executable regular file."""
+    try:
+        mode = os.stat(path).st_mode
+    except OSError:
+        return False
+    return stat.S_ISREG(mode) and bool(mode & 0o111)
+
+# The install location does not change while the process runs, so every
+# caller shares the result of the first lookup
+@lru_cache(maxsize=1)
 def find_lilypond():
     """Attempt to find the LilyPond executable on the system."""
-    try:
-        # Try to get LilyPond version which will fail if not installed
-        result = subprocess.run(['lilypond', '--version'], 
-                              capture_output=True, text=True, check=False)
-        if result.returncode == 0:
-            return 'lilypond'  # It's in the PATH
-    except FileNotFoundError:
-        pass
+    # Look for LilyPond on the PATH without starting it
+    path = shutil.which('lilypond')
+    if path:
+        return path
         
     # Common installation paths to check
     common_paths = []
@@ -42,8 +51,4 @@ def find_lilypond():
         ])
     
     # Check each path
-    for path in common_paths:
-        if os.path.isfile(path) and os.access(path, os.X_OK):
-            return path
-            
-    return None
\ No newline at end of file
+    return next((path for path in common_paths if _is_executable_file(path)), None)
\ No newline at end of file
@@ -0,0 +1,142 @@
+import re
+from functools import lru_cache
+
+# Streamlit re-executes app.py on every rerun, so patterns and caches live in
+# this module, which is imported once per process
+_TITLE_RE = re.compile(r'title\s*=\s*"([^"]*)"')
+# Characters that are not allowed in file names on common platforms
+_FILENAME_TABLE = str.maketrans(dict.fromkeys('\\/:*?"<>|', '_'))
+
+# Everything enhance_lilypond_output rewrites in music21's LilyPond output,
+# matched in a single pass over the text
+_ENHANCE_RE = re.compile(
+    r'(?P<staff>Staff\s+=\s+\w+)'
+    r'|(?P<clef>\\clef\s+"")'
+    r'|(?P<key>\\key\s+\w+\s+\\[a-zA-Z]+)'
+    r'|(?P<time>\\time\s+\d+\/\d+)'
+)
+_STAFF_NAMES = ('Staff = "upper"', 'Staff = "lower"')
+
+def _matching_brace(ly_content, open_brace):
+    """Return the offset of the brace closing the one at open_brace, or -1."""
+    # Jump between braces with str.find, tracking nesting so inner blocks
+    # such as \markup { ... } do not end the block early
+    depth = 1
+    position = open_brace + 1
+    while depth:
+        close = ly_content.find('}', position)
+        if close < 0:
+            return -1
+        nested = ly_content.find('{', position, close)
+        if nested >= 0:
+            depth += 1
+            position = nested + 1
+        else:
+            depth -= 1
+            position = close + 1
+    return position - 1
+
+def _header_span(ly_content):
+    """Return the start and end offsets of the first \\header block's body, or None."""
+    # Skip mentions of \header that do not open a block, e.g. in comments
+    header_start = ly_content.find('\\header')
+    while header_start >= 0:
+        body_start = ly_content.find('{', header_start)
+        if body_start < 0:
+            return None
+        if not ly_content[header_start + len('\\header'):body_start].strip():
+            break
+        header_start = ly_content.find('\\header', header_start + 1)
+    else:
+        return None
+
+    body_end = _matching_brace(ly_content, body_start)
+    if body_end < 0:
+        return None
+    return body_start + 1, body_end
+
+def _header_body(ly_content):
+    """Return the text inside the first \\header block, or None."""
+    span = _header_span(ly_content)
+    if span is None:
+        return None
+    return ly_content[span[0]:span[1]]
+
+# The text area content is unchanged on most reruns, e.g. when another widget
+# is used, so recent results are kept
+@lru_cache(maxsize=32)
+def extract_title_from_lilypond(ly_content):
+    """Extract the title from LilyPond header."""
+    # Look for the header block
+    header_content = _header_body(ly_content)
+    if header_content is None:
+        return None
+
+    # Look for the title within the header
+    title_match = _TITLE_RE.search(header_content)
+    if title_match:
+        title = title_match.group(1)
+        # Convert title to a valid filename by replacing problematic characters
+        safe_title = title.translate(_FILENAME_TABLE)
+        return safe_title
+
+    return None
+
+def _lilypond_string(value):
+    """Quote value as a LilyPond string literal."""
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def enhance_lilypond_output(lily_text, title="MIDI Conversion", composer="Auto-generated"):
+    """Post-process the music21-generated LilyPond code to improve structure and readability."""
+
+    staves_named = 0
+    add_tempo = '\\tempo' not in lily_text
+
+    def rewrite(match):
+        nonlocal staves_named, add_tempo
+        text = match.group()
+        kind = match.lastgroup
+        if kind == 'staff':
+            # Fix the staff naming to be more meaningful
+            if staves_named < len(_STAFF_NAMES):
+                text = _STAFF_NAMES[staves_named]
+                staves_named += 1
+        elif kind == 'clef':
+            # Fix empty clef or incorrect clefs
+            text = '\\clef "bass"'
+        elif kind == 'key':
+            # Try to identify musical sections based on key changes
+            # Add comments for better readability
+            text = '% New section\n' + text
+        elif add_tempo:
+            # Add a tempo marking after the first time signature if there is none
+            text += '\n    \\tempo 4 = 120'
+            add_tempo = False
+        return text
+
+    lily_text = _ENHANCE_RE.sub(rewrite, lily_text)
+
+    # Add proper header with title
+    fields = f'\n  title = {_lilypond_string(title)}\n  composer = {_lilypond_string(composer)}\n'
+    header_span = _header_span(lily_text)
+    if header_span is not None:
+        # Append to the existing header; LilyPond uses the last assignment, so
+        # these override any title or composer music21 wrote
+        header_end = header_span[1]
+        lily_text = lily_text[:header_end] + fields + lily_text[header_end:]
+    else:
+        # If header doesn't exist, add one
+        lily_text = lily_text.replace('\\version', '\\header {' + fields + '}\n\n\\version')
+
+    # Structure the score better
+    lily_text = lily_text.replace('\\score {', '\\score {\n  % Main score')
+
+    # Add MIDI output if not present, as a \midi block after the layout block
+    if '\\midi' not in lily_text:
+        layout_start = lily_text.find('\\layout {')
+        if layout_start >= 0:
+            layout_end = _matching_brace(lily_text, layout_start + len('\\layout '))
+            if layout_end >= 0:
+                lily_text = lily_text[:layout_end + 1] + '\n  \\midi { }' + lily_text[layout_end + 1:]
+
+    return lily_text
@@ -1,25 +1,10 @@
 import streamlit as st
 import base64
 
-def add_midi_player(midi_data):
-    """
-    Add a MIDI player widget to the Streamlit app.
-    """
-    if midi_data is None:
-        return
-    
-    # Convert MIDI data to base64
-    b64_midi = base64.b64encode(midi_data).decode()
-    
-    # Use a JavaScript library to play MIDI in the browser
-    st.markdown("### MIDI Preview")
-    st.info("Player loading... If you don't see the player below, your browser may not support MIDI playback.")
-    
-    # Add the midi.js library
-    midi_js = """
-    <script src="https://cdn.jsdelivr.net/npm/midi-player-js@2.0.16/browser/midiplayer.min.js"></script>
-    <script src="https://cdn.jsdelivr.net/npm/soundfont-player@0.12.0/dist/soundfont-player.min.js"></script>
-    
+# Player markup using the midi.js library; the MIDI data is substituted for
+# MIDI_B64_PLACEHOLDER. The libraries and the piano soundfont (several MB) are
+# only fetched on the first click of Play, not whenever the player renders.
+_MIDI_PLAYER_TEMPLATE = """
     <div id="midi-player" style="width:100%; padding:10px; border:1px solid #ddd; border-radius:5px;">
         <button id="play-button" style="padding:5px 15px; margin-right:10px;">Play</button>
         <button id="stop-button" style="padding:5px 15px;">Stop</button>
@@ -27,68 +12,104 @@ def add_midi_player(midi_data):
     </div>
     
     <script>
-        // Decode base64 MIDI
-        const midiBase64 = "%s";
-        const midiBlob = base64ToBlob(midiBase64, 'audio/midi');
-        const midiURL = URL.createObjectURL(midiBlob);
+        const midiBase64 = "MIDI_B64_PLACEHOLDER";
+        const status = document.getElementById('midi-status');
+        let player;
+        let loading;
         
-        // Initialize player
-        const player = new MidiPlayer.Player();
-        let instrument;
+        function loadScript(src) {
+            return new Promise(function(resolve, reject) {
+                const script = document.createElement('script');
+                script.src = src;
+                script.onload = resolve;
+                script.onerror = reject;
+                document.head.appendChild(script);
+            });
+        }
         
-        // Load soundfont
-        Soundfont.instrument(new AudioContext(), 'acoustic_grand_piano').then(function(piano) {
-            instrument = piano;
-            document.getElementById('midi-status').textContent = 'MIDI loaded and ready';
-            
-            // Load the MIDI file
-            fetch(midiURL)
-                .then(response => response.arrayBuffer())
-                .then(buffer => {
-                    const midiArrayBuffer = new Uint8Array(buffer);
-                    player.loadArrayBuffer(midiArrayBuffer);
-                    
-                    // Set up event handlers
+        // Load the libraries, soundfont and MIDI data once, on first use
+        function loadPlayer() {
+            if (!loading) {
+                status.textContent = 'Loading player...';
+                loading = Promise.all([
+                    loadScript('https://cdn.jsdelivr.net/npm/midi-player-js@2.0.16/browser/midiplayer.min.js'),
+                    loadScript('https://cdn.jsdelivr.net/npm/soundfont-player@0.12.0/dist/soundfont-player.min.js')
+                ]).then(function() {
+                    // The AudioContext is created from the click, which browsers
+                    // require before playing audio; the browser decodes the MIDI
+                    // from a data URL meanwhile
+                    return Promise.all([
+                        Soundfont.instrument(new AudioContext(), 'acoustic_grand_piano'),
+                        fetch('data:audio/midi;base64,' + midiBase64).then(function(response) {
+                            return response.arrayBuffer();
+                        })
+                    ]);
+                }).then(function([instrument, midiBuffer]) {
+                    player = new MidiPlayer.Player();
                     player.on('midiEvent', function(event) {
                         if (event.name === 'Note on') {
                             instrument.play(event.noteNumber, 0, {gain: event.velocity/100});
                         }
                     });
+                    player.loadArrayBuffer(midiBuffer);
+                }).catch(function(error) {
+                    // Allow another attempt on the next click
+                    loading = null;
+                    throw error;
                 });
-        });
+            }
+            return loading;
+        }
         
         // Event listeners
         document.getElementById('play-button').addEventListener('click', function() {
-            if (player.isPlaying()) {
-                player.pause();
-                this.textContent = 'Resume';
-                document.getElementById('midi-status').textContent = 'Paused';
-            } else {
-                player.play();
-                this.textContent = 'Pause';
-                document.getElementById('midi-status').textContent = 'Playing...';
-            }
+            const button = this;
+            loadPlayer().then(function() {
+                if (player.isPlaying()) {
+                    player.pause();
+                    button.textContent = 'Resume';
+                    status.textContent = 'Paused';
+                } else {
+                    player.play();
+                    button.textContent = 'Pause';
+                    status.textContent = 'Playing...';
+                }
+            }, function() {
+                status.textContent = 'The player could not be loaded';
+            });
         });
         
         document.getElementById('stop-button').addEventListener('click', function() {
+            if (!player) {
+                return;
+            }
             player.stop();
             document.getElementById('play-button').textContent = 'Play';
-            document.getElementById('midi-status').textContent = 'Stopped';
+            status.textContent = 'Stopped';
         });
-        
-        // Helper function to convert base64 to Blob
-        function base64ToBlob(base64, mimeType) {
-            const byteString = atob(base64);
-            const ab = new ArrayBuffer(byteString.length);
-            const ia = new Uint8Array(ab);
-            
-            for (let i = 0; i < byteString.length; i++) {
-                ia[i] = byteString.charCodeAt(i);
-            }
-            
-            return new Blob([ab], { type: mimeType });
-        }
     </script>
-    """ % b64_midi
+    """
+
+@st.cache_data(show_spinner=False, max_entries=8)
+def _build_player_html(midi_data):
+    """
+    Build the player markup for a MIDI file. Cached so the base64 encoding and
+    template formatting run once per file instead of on every rerun; identical
+    markup also lets Streamlit skip re-sending it to the browser.
+    """
+    # Convert MIDI data to base64
+    b64_midi = base64.b64encode(midi_data).decode("ascii")
+    return _MIDI_PLAYER_TEMPLATE.replace("MIDI_B64_PLACEHOLDER", b64_midi)
+
+def add_midi_player(midi_data):
+    """
+    Add a MIDI player widget to the Streamlit app.
+    """
+    if midi_data is None:
+        return
+    
+    # Use a JavaScript library to play MIDI in the browser
+    st.markdown("### MIDI Preview")
+    st.info("Player loading... If you don't see the player below, your browser may not support MIDI playback.")
     
-    st.components.v1.html(midi_js, height=150)
\ No newline at end of file
+    st.components.v1.html(_build_player_html(midi_data), height=150)
\ No newline at end of file